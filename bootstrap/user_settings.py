@@ -2,3 +2,16 @@ URLS = [
     ('https://1337x.to/cat/Games/1/', 'games'),
     ('https://1337x.to/cat/Movies/1/', 'movies'),
 ]
+# Urls sharing a dedup group notify an item only once,
+# set per url as a third element or for all urls with DEDUP_GROUP.
+# DEDUP_GROUP = 'default'
+# Restart the browser when the unique memory of its processes exceeds
+# this value (MB).
+# MAX_DRIVER_MEMORY_MB = 2048
+# Pause between urls while system cpu usage exceeds this value (%).
+# MAX_SYSTEM_CPU_PERCENT = 80
+# Item storage format: 'json' or 'bin' (compact, memory-mapped lookups),
+# run `parze convert` after changing it to convert existing files.
+# ITEM_STORAGE_FORMAT = 'bin'
+# Number of browser tabs loading urls concurrently.
+# MAX_TABS = 4
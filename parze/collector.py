@@ -9,16 +9,24 @@ import time
 from urllib.parse import urlparse, unquote_plus
 from uuid import uuid4
 
+import psutil
 from svcutils.service import Notifier, get_file_mtime
 from webutils.browser import get_driver
 
 from parze import NAME, logger
 from parze.parsers.base import iterate_parsers
+from parze.shard import BinaryShard, dump as shard_dump
 
 
 MAX_NOTIF_PER_URL = 4
 MAX_NOTIF_BODY_SIZE = 500
 STORAGE_RETENTION_DELTA = 7 * 24 * 3600
+STORAGE_FORMATS = ('json', 'bin')
+SEEN_DIRNAME = '_seen'
+THROTTLE_DELAY = 5
+MAX_THROTTLE_DURATION = 120
+TAB_POLL_FREQUENCY = .5
+PAGE_LOAD_TIMEOUT = 30
 
 logging.getLogger('selenium').setLevel(logging.INFO)
 logging.getLogger('urllib3').setLevel(logging.INFO)
@@ -33,6 +41,10 @@ def to_json(x):
     return json.dumps(x, indent=4, sort_keys=True)
 
 
+def get_hash(x):
+    return hashlib.md5(x.encode('utf-8')).hexdigest()
+
+
 def clean_item(item):
     res = re.sub(r'\(.*?\)', '', item).strip()
     res = re.sub(r'\[.*?\]', '', res).strip()
@@ -41,23 +53,50 @@ def clean_item(item):
 
 
 class ItemStorage:
-    def __init__(self, base_path):
+    def __init__(self, base_path, storage_format='json'):
+        if storage_format not in STORAGE_FORMATS:
+            raise Exception(f'invalid storage format {storage_format}')
         self.base_path = os.path.realpath(base_path)
+        self.storage_format = storage_format
 
     def _get_dst_dirname(self, url):
-        return hashlib.md5(url.encode('utf-8')).hexdigest()
+        return get_hash(url)
 
     def _get_dst_path(self, url):
         return os.path.join(self.base_path, self._get_dst_dirname(url))
 
     def _generate_dst_filename(self):
-        return f'{uuid4().hex}.json'
+        return f'{uuid4().hex}.{self.storage_format}'
+
+    def _iterate_files(self, path):
+        for storage_format in STORAGE_FORMATS:
+            yield from glob(os.path.join(path, f'*.{storage_format}'))
+
+    def _load_file(self, file):
+        if file.endswith('.bin'):
+            with BinaryShard(file) as shard:
+                return dict(shard.iterate_items())
+        with open(file) as fd:
+            return json.load(fd)
+
+    def _dump_file(self, items, file):
+        if file.endswith('.bin'):
+            shard_dump(items, file)
+        else:
+            with open(file, 'w') as fd:
+                fd.write(to_json(items))
+
+    def _filter_file_items(self, file, items):
+        if file.endswith('.bin'):
+            with BinaryShard(file) as shard:
+                return {k: v for k, v in items.items() if k not in shard}
+        stored_items = self._load_file(file)
+        return {k: v for k, v in items.items() if k not in stored_items}
 
     def _iterate_file_and_items(self, url):
-        for file in glob(os.path.join(self._get_dst_path(url), '*.json')):
+        for file in self._iterate_files(self._get_dst_path(url)):
             try:
-                with open(file) as fd:
-                    items = json.load(fd)
+                items = self._load_file(file)
             except Exception:
                 logger.exception(f'failed to load file {file}')
                 continue
@@ -70,27 +109,57 @@ class ItemStorage:
         return res
 
     def get_new_items(self, url, items):
-        stored_items = self._load_items(url)
-        return {k: v for k, v in items.items() if k not in stored_items}
+        res = dict(items)
+        for file in self._iterate_files(self._get_dst_path(url)):
+            if not res:
+                break
+            try:
+                res = self._filter_file_items(file, res)
+            except Exception:
+                logger.exception(f'failed to load file {file}')
+        return res
 
     def save(self, url, all_items, new_items):
-        all_item_keys = set(all_items.keys())
-        for file, items in self._iterate_file_and_items(url):
-            if not set(items.keys()) & all_item_keys:
+        for file in self._iterate_files(self._get_dst_path(url)):
+            try:
+                remaining_items = self._filter_file_items(file, all_items)
+            except Exception:
+                logger.exception(f'failed to load file {file}')
+                continue
+            if len(remaining_items) == len(all_items):
                 os.remove(file)
                 logger.debug(f'removed old file {file}')
 
         dst_path = self._get_dst_path(url)
         makedirs(dst_path)
-        file = os.path.join(dst_path, self._generate_dst_filename())
-        with open(file, 'w') as fd:
-            fd.write(to_json(new_items))
+        self._dump_file(new_items,
+            os.path.join(dst_path, self._generate_dst_filename()))
 
-    def cleanup(self, all_urls):
+    def convert(self):
+        for path in glob(os.path.join(self.base_path, '*')):
+            if os.path.basename(path) == SEEN_DIRNAME:
+                continue
+            for file in self._iterate_files(path):
+                basename, ext = os.path.splitext(file)
+                if ext == f'.{self.storage_format}':
+                    continue
+                try:
+                    items = self._load_file(file)
+                except Exception:
+                    logger.exception(f'failed to load file {file}')
+                    continue
+                dst_file = f'{basename}.{self.storage_format}'
+                self._dump_file(items, dst_file)
+                stat = os.stat(file)
+                os.utime(dst_file, (stat.st_atime, stat.st_mtime))
+                os.remove(file)
+                logger.debug(f'converted file {file} to {dst_file}')
+
+    def cleanup(self, all_urls, all_groups=None):
         dirnames = {self._get_dst_dirname(r) for r in all_urls}
         min_ts = time.time() - STORAGE_RETENTION_DELTA
         for path in glob(os.path.join(self.base_path, '*')):
-            if os.path.basename(path) in dirnames:
+            if os.path.basename(path) in dirnames | {SEEN_DIRNAME}:
                 continue
             mtimes = [get_file_mtime(r)
                 for r in glob(os.path.join(path, '*'))]
@@ -98,9 +167,103 @@ class ItemStorage:
                 shutil.rmtree(path)
                 logger.info(f'removed old storage path {path}')
 
+        filenames = {f'{get_hash(r)}.json' for r in all_groups or []}
+        for file in glob(os.path.join(self.base_path, SEEN_DIRNAME, '*.json')):
+            if os.path.basename(file) not in filenames:
+                os.remove(file)
+                logger.info(f'removed old seen index file {file}')
+
+
+class SeenIndex:
+    """Hashed item names shared by the urls of a dedup group."""
+
+    def __init__(self, base_path, group):
+        self.group = group
+        self.file = os.path.join(os.path.realpath(base_path), SEEN_DIRNAME,
+            f'{get_hash(group)}.json')
+        self.keys = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.file):
+            return {}
+        try:
+            with open(self.file) as fd:
+                return json.load(fd)
+        except Exception:
+            logger.exception(f'failed to load file {self.file}')
+            return {}
+
+    def get_new_items(self, items):
+        return {k: v for k, v in items.items()
+            if get_hash(k) not in self.keys}
+
+    def update(self, items):
+        now = time.time()
+        self.keys.update({get_hash(k): now for k in items.keys()})
+
+    def save(self):
+        min_ts = time.time() - STORAGE_RETENTION_DELTA
+        self.keys = {k: v for k, v in self.keys.items() if v >= min_ts}
+        makedirs(os.path.dirname(self.file))
+        with open(self.file, 'w') as fd:
+            fd.write(to_json(self.keys))
+
+
+class DriverMonitor:
+    """Samples memory and cpu usage of a driver and its browser processes."""
+
+    def __init__(self):
+        self.peak_memory = 0
+        self.peak_cpu_percent = 0
+        self.reset()
+
+    def reset(self):
+        self.last_ts = None
+        self.last_cpu_time = None
+
+    def _iterate_processes(self, driver):
+        try:
+            proc = psutil.Process(driver.service.process.pid)
+        except (AttributeError, psutil.Error):
+            return
+        yield proc
+        try:
+            yield from proc.children(recursive=True)
+        except psutil.Error:
+            return
+
+    def _get_memory(self, proc):
+        # Unique set size, so that pages shared between the browser
+        # processes are not counted once per process.
+        try:
+            return proc.memory_full_info().uss
+        except psutil.AccessDenied:
+            return proc.memory_info().rss
+
+    def sample(self, driver):
+        memory = 0
+        cpu_time = 0
+        for proc in self._iterate_processes(driver):
+            try:
+                memory += self._get_memory(proc)
+                cpu_times = proc.cpu_times()
+                cpu_time += cpu_times.user + cpu_times.system
+            except psutil.Error:
+                continue
+        now = time.time()
+        cpu_percent = 0
+        if self.last_ts is not None and now > self.last_ts:
+            cpu_percent = max(0, 100 * (cpu_time - self.last_cpu_time)
+                / (now - self.last_ts))
+        self.last_ts = now
+        self.last_cpu_time = cpu_time
+        self.peak_memory = max(self.peak_memory, memory)
+        self.peak_cpu_percent = max(self.peak_cpu_percent, cpu_percent)
+        return memory, cpu_percent
+
 
 class URLItem:
-    def __init__(self, url_item):
+    def __init__(self, url_item, default_group=None):
         if not isinstance(url_item, (list, tuple)):
             url_item = [url_item]
         self.url = url_item[0]
@@ -108,9 +271,13 @@ class URLItem:
             self.id = url_item[1]
         except IndexError:
             self.id = self._get_default_id()
+        try:
+            self.group = url_item[2]
+        except IndexError:
+            self.group = default_group
 
     def __repr__(self):
-        return f'id: {self.id}, url: {self.url}'
+        return f'id: {self.id}, url: {self.url}, group: {self.group}'
 
     def _get_default_id(self):
         parsed = urlparse(unquote_plus(self.url))
@@ -122,13 +289,96 @@ class URLItem:
 class ItemCollector:
     def __init__(self, config, headless=True):
         self.config = config
-        self.driver = get_driver(
+        self.headless = headless
+        self.item_storage = ItemStorage(self.config.ITEM_STORAGE_PATH,
+            storage_format=self.config.ITEM_STORAGE_FORMAT)
+        self.driver = self._get_driver()
+        self.driver_monitor = DriverMonitor()
+        self.max_driver_memory = self.config.MAX_DRIVER_MEMORY_MB * 1024 * 1024
+        self.max_system_cpu_percent = self.config.MAX_SYSTEM_CPU_PERCENT
+        self.max_tabs = max(1, self.config.MAX_TABS)
+        psutil.cpu_percent(interval=None)
+        self.parsers = list(iterate_parsers())
+        self.seen_indexes = {}
+        self.notified_keys = set()
+
+    def _get_driver(self):
+        # Parsers wait for the pages themselves, so that tabs load
+        # concurrently.
+        driver = get_driver(
             browser_id=self.config.BROWSER_ID,
-            headless=headless,
-            page_load_strategy='eager',
+            headless=self.headless,
+            page_load_strategy='none',
         )
-        self.parsers = list(iterate_parsers())
-        self.item_storage = ItemStorage(self.config.ITEM_STORAGE_PATH)
+        driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+        return driver
+
+    def _restart_driver(self):
+        try:
+            self.driver.quit()
+        except Exception:
+            logger.exception('failed to quit driver')
+        self.driver = None
+        self.driver_monitor.reset()
+        self.driver = self._get_driver()
+        psutil.cpu_percent(interval=None)
+
+    def _wait_for_system_load(self, driver_cpu_percent):
+        # Exclude the driver usage so that the collection does not throttle
+        # the load it just caused.
+        end_ts = time.time() + MAX_THROTTLE_DURATION
+        while True:
+            cpu_percent = max(0, psutil.cpu_percent(interval=None)
+                - driver_cpu_percent / psutil.cpu_count())
+            if cpu_percent <= self.max_system_cpu_percent:
+                return
+            if time.time() > end_ts:
+                logger.warning(f'system cpu usage still exceeds '
+                    f'{self.max_system_cpu_percent}%, resuming')
+                return
+            logger.info(f'system cpu usage {cpu_percent:.0f}% exceeds '
+                f'{self.max_system_cpu_percent}%, throttling')
+            time.sleep(THROTTLE_DELAY)
+            _, driver_cpu_percent = self.driver_monitor.sample(self.driver)
+
+    def _govern_resources(self):
+        """Waits for the system load to decrease and returns True when
+        the driver uses too much memory and must be restarted.
+        """
+        try:
+            memory, cpu_percent = self.driver_monitor.sample(self.driver)
+        except Exception:
+            logger.exception('failed to sample driver usage')
+            return False
+        logger.debug(f'driver usage: {memory / 1024 / 1024:.0f} MB, '
+            f'{cpu_percent:.0f}% cpu')
+        if memory > self.max_driver_memory:
+            logger.info(f'driver memory {memory / 1024 / 1024:.0f} MB '
+                f'exceeds {self.max_driver_memory / 1024 / 1024:.0f} MB, '
+                'restarting driver')
+            return True
+        try:
+            self._wait_for_system_load(cpu_percent)
+        except Exception:
+            logger.exception('failed to wait for system load')
+        return False
+
+    def _get_seen_index(self, group):
+        if group not in self.seen_indexes:
+            self.seen_indexes[group] = SeenIndex(
+                self.config.ITEM_STORAGE_PATH, group)
+        return self.seen_indexes[group]
+
+    def _get_notif_items(self, url_item, items, new_items):
+        res = new_items
+        if url_item.group:
+            seen_index = self._get_seen_index(url_item.group)
+            res = seen_index.get_new_items(res)
+            seen_index.update(items)
+        res = {k: v for k, v in res.items()
+            if get_hash(k) not in self.notified_keys}
+        self.notified_keys.update({get_hash(k) for k in res.keys()})
+        return res
 
     def _notify_new_items(self, url_item, items):
         title = f'{NAME} {url_item.id}'
@@ -148,16 +398,93 @@ class ItemCollector:
     def _iterate_parsers(self, url_item):
         for parser_cls in self.parsers:
             if parser_cls.can_parse_url(url_item.url):
-                yield parser_cls(self.driver)
+                yield parser_cls
+
+    def _get_tabs(self, count):
+        handles = self.driver.window_handles
+        while len(handles) < count:
+            self.driver.switch_to.new_window('tab')
+            handles = self.driver.window_handles
+        return handles[:count]
+
+    def _reset_tabs(self):
+        if not self.driver:
+            return
+        try:
+            handles = self.driver.window_handles
+            for handle in handles[1:]:
+                self.driver.switch_to.window(handle)
+                self.driver.close()
+            self.driver.switch_to.window(handles[0])
+            self.driver.get('about:blank')
+        except Exception:
+            logger.exception('failed to reset tabs')
+
+    def _harvest_tabs(self, tasks):
+        """Loads the (url_item, parser class) tasks concurrently in a pool
+        of max_tabs tabs, refilling a tab as soon as it is harvested, and
+        yields the index and the names or exception of each task.
+        """
+        queue = list(range(len(tasks)))
+        pending = {}
+        handles = None
+        restart = False
+        try:
+            while queue or pending:
+                if restart and not pending:
+                    self._restart_driver()
+                    restart = False
+                    handles = None
+                if handles is None:
+                    try:
+                        handles = self._get_tabs(
+                            min(self.max_tabs, len(queue)))
+                    except Exception as exc:
+                        logger.exception('failed to open tabs')
+                        for i in queue:
+                            yield i, exc
+                        return
+                for handle in handles:
+                    if restart or handle in pending or not queue:
+                        continue
+                    i = queue.pop(0)
+                    url_item, parser_cls = tasks[i]
+                    parser = parser_cls(self.driver, headless=self.headless)
+                    try:
+                        self.driver.switch_to.window(handle)
+                        parser.navigate(url_item.url)
+                        pending[handle] = i, parser
+                    except Exception as exc:
+                        yield i, exc
+                for handle, (i, parser) in list(pending.items()):
+                    try:
+                        self.driver.switch_to.window(handle)
+                        els = parser.poll()
+                        if els is None:
+                            continue
+                        start_ts = time.time()
+                        res = [r for r in parser.harvest(els) if r]
+                    except Exception as exc:
+                        start_ts = time.time()
+                        res = exc
+                    del pending[handle]
+                    yield i, res
+                    restart = self._govern_resources() or restart
+                    # Processing and governance block the polling of the
+                    # other tabs.
+                    for _, other_parser in pending.values():
+                        other_parser.postpone(time.time() - start_ts)
+                if pending:
+                    time.sleep(TAB_POLL_FREQUENCY)
+        finally:
+            self._reset_tabs()
 
-    def _collect_items(self, url_item):
-        parsers = list(self._iterate_parsers(url_item))
-        if not parsers:
-            raise Exception('no available parser')
+    def _collect_items(self, url_item, parser_results):
         items = {}
         now = time.time()
-        for parser in sorted(parsers, key=lambda x: x.id):
-            names = [r for r in parser.parse(url_item.url) if r]
+        for parser, names in sorted(parser_results, key=lambda x: x[0].id):
+            if isinstance(names, Exception):
+                raise names
             logger.debug(f'{parser.id} results ({url_item.url}):\n'
                 f'{json.dumps(names, indent=4)}')
             if not names:
@@ -168,34 +495,74 @@ class ItemCollector:
             items.update({r: now - i for i, r in enumerate(names)})
         return items
 
-    def _process_url_item(self, url_item):
-        items = self._collect_items(url_item)
+    def _process_url_item(self, url_item, parser_results):
+        items = self._collect_items(url_item, parser_results)
         if not items:
             raise Exception('no result')
         logger.info(f'parsed {len(items)} items from {url_item.url}')
         new_items = self.item_storage.get_new_items(url_item.url, items)
+        notif_items = self._get_notif_items(url_item, items, new_items)
+        if notif_items:
+            self._notify_new_items(url_item, notif_items)
         if new_items:
-            self._notify_new_items(url_item, new_items)
             self.item_storage.save(url_item.url, items, new_items)
 
+    def _notify_error(self, url_item, exc):
+        Notifier().send(title=f'{NAME} error',
+            body=f'failed to process {url_item.id}: {exc}')
+
+    def _get_tasks(self, url_items):
+        res = []
+        for url_item in url_items:
+            parsers = list(self._iterate_parsers(url_item))
+            if not parsers:
+                logger.error(f'no available parser for {url_item}')
+                self._notify_error(url_item, Exception('no available parser'))
+            res.extend((url_item, r) for r in parsers)
+        return res
+
+    def _process_url_items(self, url_items):
+        tasks = self._get_tasks(url_items)
+        remaining = {}
+        for url_item, _ in tasks:
+            remaining[url_item] = remaining.get(url_item, 0) + 1
+        parser_results = {}
+        for i, res in self._harvest_tabs(tasks):
+            url_item, parser_cls = tasks[i]
+            parser_results.setdefault(url_item, []).append((parser_cls, res))
+            remaining[url_item] -= 1
+            if remaining[url_item]:
+                continue
+            try:
+                self._process_url_item(url_item, parser_results.pop(url_item))
+            except Exception as exc:
+                logger.exception(f'failed to process {url_item}')
+                self._notify_error(url_item, exc)
+
     def run(self):
         start_ts = time.time()
-        urls = set()
+        url_items = [URLItem(r, default_group=self.config.DEDUP_GROUP)
+            for r in self.config.URLS]
         try:
-            for url in self.config.URLS:
-                url_item = URLItem(url)
-                urls.add(url_item.url)
-                try:
-                    self._process_url_item(url_item)
-                except Exception as exc:
-                    logger.exception(f'failed to process {url_item}')
-                    Notifier().send(title=f'{NAME} error',
-                        body=f'failed to process {url_item.id}: {exc}')
+            self._process_url_items(url_items)
+            self.driver_monitor.sample(self.driver)
         finally:
-            self.driver.quit()
-        self.item_storage.cleanup(urls)
-        logger.info(f'processed in {time.time() - start_ts:.02f} seconds')
+            for seen_index in self.seen_indexes.values():
+                seen_index.save()
+            if self.driver:
+                self.driver.quit()
+        self.item_storage.cleanup({r.url for r in url_items},
+            all_groups={r.group for r in url_items if r.group})
+        logger.info(f'processed in {time.time() - start_ts:.02f} seconds, '
+            f'driver peak usage: '
+            f'{self.driver_monitor.peak_memory / 1024 / 1024:.0f} MB, '
+            f'{self.driver_monitor.peak_cpu_percent:.0f}% cpu')
 
 
 def collect(config, headless=True):
     ItemCollector(config, headless=headless).run()
+
+
+def convert_storage(config):
+    ItemStorage(config.ITEM_STORAGE_PATH,
+        storage_format=config.ITEM_STORAGE_FORMAT).convert()
@@ -5,7 +5,7 @@ import sys
 from svcutils.service import Config, Service
 
 from parze import WORK_PATH
-from parze.collector import collect
+from parze.collector import collect, convert_storage
 
 
 def parse_args():
@@ -16,6 +16,7 @@ def parse_args():
     collect_parser.add_argument('--daemon', action='store_true')
     collect_parser.add_argument('--task', action='store_true')
     collect_parser.add_argument('--interactive', '-i', action='store_true')
+    subparsers.add_parser('convert')
     args = parser.parse_args()
     if not args.cmd:
         parser.print_help()
@@ -29,7 +30,12 @@ def main():
     config = Config(
         os.path.join(path, 'user_settings.py'),
         ITEM_STORAGE_PATH=os.path.join(path, 'parzed'),
+        ITEM_STORAGE_FORMAT='json',
         BROWSER_ID='chrome',
+        DEDUP_GROUP=None,
+        MAX_DRIVER_MEMORY_MB=2048,
+        MAX_SYSTEM_CPU_PERCENT=80,
+        MAX_TABS=1,
     )
     if args.cmd == 'collect':
         service = Service(
@@ -48,6 +54,8 @@ def main():
             service.run_once()
         else:
             collect(config, headless=not args.interactive)
+    elif args.cmd == 'convert':
+        convert_storage(config)
 
 
 if __name__ == '__main__':
@@ -1,4 +1,3 @@
-import time
 from urllib.parse import urlparse
 
 from selenium.common.exceptions import NoSuchElementException
@@ -22,27 +21,20 @@ class X1337xParser(BaseParser):
         except NoSuchElementException:
             return False
 
-    def _wait_for_elements(self, url, poll_frequency=.5, timeout=10):
-        self.driver.get(url)
-        end_ts = time.time() + timeout
-        while time.time() < end_ts:
-            try:
-                els = self.driver.find_elements(By.XPATH, '//table/tbody/tr')
-                if not els:
-                    raise NoSuchElementException()
-                return els
-            except NoSuchElementException:
-                if self._has_no_results():
-                    logger.debug('no result')
-                    return []
-                time.sleep(poll_frequency)
-        raise Exception('timeout')
+    def _find_elements(self):
+        els = self.driver.find_elements(By.XPATH, '//table/tbody/tr')
+        if els:
+            return els
+        if self._has_no_results():
+            logger.debug('no result')
+            return []
+        return None
 
     def _get_name(self, text):
         return text.splitlines()[0].strip()
 
-    def parse(self, url):
-        for el in self._wait_for_elements(url):
+    def _iterate_names(self, els):
+        for el in els:
             tds = el.find_elements(By.XPATH, './/td')
             name_el = tds[0]
             name = self._get_name(name_el.text)
@@ -1,23 +1,75 @@
 import importlib
 import inspect
 import os
+import time
+
+from selenium.common.exceptions import WebDriverException
 
 from parze import logger
 
 
+# The navigation is deferred so that the script returns before it starts.
+NAVIGATE_SCRIPT = ('window.parzeNavigation = true;'
+    'var url = arguments[0];'
+    'setTimeout(function() { window.location.href = url; }, 0);')
+IS_LOADED_SCRIPT = ('return !window.parzeNavigation'
+    ' && document.readyState !== "loading";')
+
+
 class BaseParser:
     id = None
+    load_timeout = 30
+    timeout = 10
 
-    def __init__(self, driver):
+    def __init__(self, driver, headless=True):
         self.driver = driver
+        self.headless = headless
+        self.end_ts = None
+        self.loaded = False
 
     @staticmethod
     def can_parse_url(url):
         raise NotImplementedError()
 
-    def parse(self, url):
+    def _find_elements(self):
+        """Returns the item elements, an empty list if the page has no result
+        or None if the elements are not available yet.
+        """
+        raise NotImplementedError()
+
+    def _iterate_names(self, els):
         raise NotImplementedError()
 
+    def navigate(self, url):
+        """Starts loading the url in the current window without waiting."""
+        self.end_ts = time.time() + self.load_timeout
+        self.loaded = False
+        self.driver.execute_script(NAVIGATE_SCRIPT, url)
+
+    def postpone(self, delta):
+        self.end_ts += delta
+
+    def poll(self):
+        if not self.loaded:
+            try:
+                loaded = self.driver.execute_script(IS_LOADED_SCRIPT)
+            except WebDriverException:
+                # The page is being replaced or is still blocking commands.
+                loaded = False
+            if not loaded:
+                if time.time() > self.end_ts:
+                    raise Exception('load timeout')
+                return None
+            self.loaded = True
+            self.end_ts = time.time() + self.timeout
+        els = self._find_elements()
+        if els is None and time.time() > self.end_ts:
+            raise Exception('timeout')
+        return els
+
+    def harvest(self, els):
+        return list(self._iterate_names(els))
+
 
 def iterate_parsers(package='parze.parsers'):
     for filename in os.listdir(os.path.dirname(os.path.realpath(__file__))):
@@ -1,4 +1,3 @@
-import time
 from urllib.parse import urlparse
 
 from selenium.common.exceptions import NoSuchElementException
@@ -22,29 +21,25 @@ class RutrackerParser(BaseParser):
         except NoSuchElementException:
             return False
 
-    def _wait_for_elements(self, url, poll_frequency=.5, timeout=10):
-        self.driver.get(url)
-        end_ts = time.time() + timeout
-        wait_for_login = False
-        while time.time() < end_ts:
-            try:
-                els = self.driver.find_elements(By.XPATH,
-                    '//div[contains(@class, "t-title")]')
-                if not els:
-                    raise NoSuchElementException()
-                return els
-            except NoSuchElementException:
-                if self._requires_login() and not wait_for_login:
-                    if self.headless:
-                        raise Exception('requires login')
-                    logger.info('waiting for user login...')
-                    wait_for_login = True
-                    end_ts += 120
-                time.sleep(poll_frequency)
-        raise Exception('timeout')
-
-    def parse(self, url):
-        for el in self._wait_for_elements(url):
+    def navigate(self, url):
+        super().navigate(url)
+        self.wait_for_login = False
+
+    def _find_elements(self):
+        els = self.driver.find_elements(By.XPATH,
+            '//div[contains(@class, "t-title")]')
+        if els:
+            return els
+        if self._requires_login() and not self.wait_for_login:
+            if self.headless:
+                raise Exception('requires login')
+            logger.info('waiting for user login...')
+            self.wait_for_login = True
+            self.end_ts += 120
+        return None
+
+    def _iterate_names(self, els):
+        for el in els:
             name_el = el.find_element(By.XPATH, './/a')
             name = name_el.text.strip()
             if not name:
@@ -0,0 +1,81 @@
+import hashlib
+import mmap
+import struct
+import zlib
+
+
+MAGIC = b'PRZ1'
+HEADER = struct.Struct('<4sI')
+# hashed name, timestamp, string table offset, string length
+RECORD = struct.Struct('<8sdII')
+KEY_SIZE = 8
+
+
+def get_key(name):
+    return hashlib.md5(name.encode('utf-8')).digest()[:KEY_SIZE]
+
+
+def dump(items, file):
+    records = sorted((get_key(k), v, k.encode('utf-8'))
+        for k, v in items.items())
+    strings = bytearray()
+    with open(file, 'wb') as fd:
+        fd.write(HEADER.pack(MAGIC, len(records)))
+        for key, ts, name in records:
+            fd.write(RECORD.pack(key, ts, len(strings), len(name)))
+            strings += name
+        fd.write(zlib.compress(strings))
+
+
+class BinaryShard:
+    """Sorted fixed-width records of hashed names and timestamps followed
+    by a compressed string table, looked up by binary search on a memory map.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        with open(file, 'rb') as fd:
+            self.mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self.mm) < HEADER.size:
+                raise Exception(f'truncated shard file {file}')
+            magic, self.count = HEADER.unpack_from(self.mm, 0)
+            if magic != MAGIC:
+                raise Exception(f'invalid shard file {file}')
+            self.strings_offset = HEADER.size + self.count * RECORD.size
+            if len(self.mm) < self.strings_offset:
+                raise Exception(f'truncated shard file {file}')
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.mm.close()
+
+    def _get_key(self, index):
+        offset = HEADER.size + index * RECORD.size
+        return self.mm[offset:offset + KEY_SIZE]
+
+    def __contains__(self, name):
+        key = get_key(name)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._get_key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < self.count and self._get_key(lo) == key
+
+    def iterate_items(self):
+        strings = zlib.decompress(self.mm[self.strings_offset:])
+        for index in range(self.count):
+            _, ts, offset, size = RECORD.unpack_from(self.mm,
+                HEADER.size + index * RECORD.size)
+            yield strings[offset:offset + size].decode('utf-8'), ts
@@ -9,6 +9,7 @@ setup(
     packages=find_packages(exclude=['tests*']),
     python_requires='>=3.10',
     install_requires=[
+        'psutil',
         # 'svcutils @ git+https://github.com/jererc/svcutils.git@main#egg=svcutils',
         # 'webutils @ git+https://github.com/jererc/webutils.git@main#egg=webutils',
         'svcutils @ https://github.com/jererc/svcutils/archive/refs/heads/main.zip',
@@ -1,10 +1,11 @@
+from glob import glob
 import logging
 import os
 from pprint import pprint
 import shutil
 import time
 import unittest
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 import parze as module
 WORK_PATH = os.path.join(os.path.expanduser('~'), '_test_parze')
@@ -12,6 +13,7 @@ module.WORK_PATH = WORK_PATH
 module.logger.setLevel(logging.DEBUG)
 module.logger.handlers.clear()
 from parze import collector as module
+from parze import shard
 from parze.parsers import base
 
 
@@ -27,49 +29,75 @@ def makedirs(path):
         os.makedirs(path)
 
 
-class StorageTestCase(unittest.TestCase):
+def gen_items(keys):
+    return {str(k): 0 for k in keys}
+
+
+def get_config(**config):
+    config = {
+        'BROWSER_ID': 'chrome',
+        'ITEM_STORAGE_PATH': os.path.join(WORK_PATH, 'parzed'),
+        'ITEM_STORAGE_FORMAT': 'json',
+        'DEDUP_GROUP': None,
+        'MAX_DRIVER_MEMORY_MB': 2048,
+        'MAX_SYSTEM_CPU_PERCENT': 80,
+        'MAX_TABS': 1,
+        **config,
+    }
+    return Mock(spec=list(config.keys()), **config)
+
+
+def get_collector(**config):
+    with patch.object(module, 'get_driver'):
+        return module.ItemCollector(get_config(**config))
+
+
+class BaseTestCase(unittest.TestCase):
     def setUp(self):
         remove_path(WORK_PATH)
         makedirs(WORK_PATH)
         self.base_path = os.path.join(WORK_PATH, 'parzed')
 
-    def _gen_items(self, keys):
-        return {str(k): 0 for k in keys}
+
+class StorageTestCase(BaseTestCase):
+    storage_format = 'json'
 
     def test_1(self):
         url1 = 'https://1337x.to/user/1/'
         url2 = 'https://1337x.to/user/2/'
 
-        obj = module.ItemStorage(base_path=self.base_path)
+        obj = module.ItemStorage(base_path=self.base_path,
+            storage_format=self.storage_format)
         self.assertTrue(obj._get_dst_path(url1) != obj._get_dst_path(url2))
 
-        all_items = self._gen_items(range(1, 6))
+        all_items = gen_items(range(1, 6))
         new_items = obj.get_new_items(url1, all_items)
         self.assertEqual(new_items, all_items)
         obj.save(url1, all_items, new_items)
 
-        all_items = self._gen_items(range(3, 8))
+        all_items = gen_items(range(3, 8))
         new_items = obj.get_new_items(url1, all_items)
-        self.assertEqual(new_items, self._gen_items(range(6, 8)))
+        self.assertEqual(new_items, gen_items(range(6, 8)))
         obj.save(url1, all_items, new_items)
 
-        obj = module.ItemStorage(base_path=self.base_path)
-        all_items = self._gen_items(range(7, 11))
+        obj = module.ItemStorage(base_path=self.base_path,
+            storage_format=self.storage_format)
+        all_items = gen_items(range(7, 11))
         new_items = obj.get_new_items(url1, all_items)
-        self.assertEqual(new_items, self._gen_items(range(8, 11)))
+        self.assertEqual(new_items, gen_items(range(8, 11)))
         obj.save(url1, all_items, new_items)
 
         url1_items = obj._load_items(url1)
         self.assertTrue(url1_items)
 
-        all_items = self._gen_items(range(11, 21))
+        all_items = gen_items(range(11, 21))
         new_items = obj.get_new_items(url2, all_items)
         self.assertEqual(new_items, all_items)
         obj.save(url2, all_items, new_items)
 
-        all_items = self._gen_items(range(13, 24))
+        all_items = gen_items(range(13, 24))
         new_items = obj.get_new_items(url2, all_items)
-        self.assertEqual(new_items, self._gen_items(range(21, 24)))
+        self.assertEqual(new_items, gen_items(range(21, 24)))
         obj.save(url2, all_items, new_items)
 
         url1_items2 = obj._load_items(url1)
@@ -82,6 +110,384 @@ class StorageTestCase(unittest.TestCase):
         self.assertTrue(obj._load_items(url2))
 
 
+class BinaryStorageTestCase(StorageTestCase):
+    storage_format = 'bin'
+
+    def test_shard(self):
+        file = os.path.join(WORK_PATH, 'shard.bin')
+        items = {f'item {i} ☃': float(i) for i in range(100)}
+        module.shard_dump(items, file)
+        with module.BinaryShard(file) as shard:
+            self.assertEqual(shard.count, 100)
+            self.assertTrue(all(k in shard for k in items.keys()))
+            self.assertFalse(any(f'other {i}' in shard for i in range(100)))
+            self.assertEqual(dict(shard.iterate_items()), items)
+
+        module.shard_dump({}, file)
+        with module.BinaryShard(file) as shard:
+            self.assertFalse('item' in shard)
+
+    def test_convert(self):
+        url = 'https://1337x.to/user/1/'
+        obj = module.ItemStorage(base_path=self.base_path)
+        all_items = gen_items(range(1, 6))
+        obj.save(url, all_items, all_items)
+        all_items = gen_items(range(3, 8))
+        new_items = obj.get_new_items(url, all_items)
+        obj.save(url, all_items, new_items)
+        items = obj._load_items(url)
+
+        obj = module.ItemStorage(base_path=self.base_path,
+            storage_format='bin')
+        obj.convert()
+        dst_path = obj._get_dst_path(url)
+        self.assertFalse(glob(os.path.join(dst_path, '*.json')))
+        self.assertEqual(len(glob(os.path.join(dst_path, '*.bin'))), 2)
+        self.assertEqual(obj._load_items(url), items)
+        self.assertEqual(obj.get_new_items(url, gen_items(range(6, 10))),
+            gen_items(range(8, 10)))
+
+        obj = module.ItemStorage(base_path=self.base_path)
+        obj.convert()
+        self.assertEqual(obj._load_items(url), items)
+
+    def test_invalid_shard(self):
+        file = os.path.join(WORK_PATH, 'shard.bin')
+        module.shard_dump({f'item {i}': float(i) for i in range(10)}, file)
+        with open(file, 'rb') as fd:
+            data = fd.read()
+        for size in (0, 4, shard.HEADER.size + 10):
+            with open(file, 'wb') as fd:
+                fd.write(data[:size])
+            self.assertRaises(Exception, module.BinaryShard, file)
+            os.remove(file)
+
+    def test_invalid_format(self):
+        with patch.object(module, 'get_driver') as mock_get_driver:
+            self.assertRaises(Exception, module.ItemCollector,
+                get_config(ITEM_STORAGE_FORMAT='binary'))
+        mock_get_driver.assert_not_called()
+
+
+@unittest.skipUnless(os.environ.get('BENCHMARK'), 'set BENCHMARK=1 to run')
+class StorageBenchmarkTestCase(BaseTestCase):
+    def test_1(self):
+        url = 'https://1337x.to/user/1/'
+        now = time.time()
+        items = {f'Some Item Name {i} (v1.0.{i}) [Repack]': now - i
+            for i in range(20000)}
+        lookup_items = {f'Some Item Name {i} (v1.0.{i}) [Repack]': now - i
+            for i in range(19900, 20100)}
+        res = {}
+        for storage_format in module.STORAGE_FORMATS:
+            obj = module.ItemStorage(
+                base_path=os.path.join(self.base_path, storage_format),
+                storage_format=storage_format)
+            obj.save(url, items, items)
+            size = sum(os.path.getsize(r)
+                for r in glob(os.path.join(obj._get_dst_path(url), '*')))
+            start_ts = time.perf_counter()
+            self.assertEqual(len(obj._load_items(url)), len(items))
+            load_time = time.perf_counter() - start_ts
+            start_ts = time.perf_counter()
+            self.assertEqual(len(obj.get_new_items(url, lookup_items)), 100)
+            res[storage_format] = {
+                'size': size,
+                'load_time': load_time,
+                'lookup_time': time.perf_counter() - start_ts,
+            }
+        pprint(res)
+        self.assertTrue(res['bin']['size'] < res['json']['size'])
+
+
+class SeenIndexTestCase(BaseTestCase):
+    def test_1(self):
+        obj = module.SeenIndex(base_path=self.base_path, group='group1')
+        all_items = gen_items(range(1, 6))
+        self.assertEqual(obj.get_new_items(all_items), all_items)
+        obj.update(all_items)
+        self.assertEqual(len(obj.keys), 5)
+
+        all_items = gen_items(range(3, 8))
+        self.assertEqual(obj.get_new_items(all_items),
+            gen_items(range(6, 8)))
+        obj.update(all_items)
+        obj.save()
+
+        obj = module.SeenIndex(base_path=self.base_path, group='group1')
+        self.assertEqual(len(obj.keys), 7)
+        self.assertFalse(obj.get_new_items(gen_items(range(1, 8))))
+
+        obj2 = module.SeenIndex(base_path=self.base_path, group='group2')
+        self.assertFalse(obj2.keys)
+
+        obj.keys = {k: time.time() - module.STORAGE_RETENTION_DELTA - 1
+            for k in obj.keys.keys()}
+        obj.save()
+        obj = module.SeenIndex(base_path=self.base_path, group='group1')
+        self.assertFalse(obj.keys)
+
+    def test_cleanup(self):
+        obj = module.SeenIndex(base_path=self.base_path, group='group1')
+        obj.update(gen_items(range(1, 6)))
+        obj.save()
+        storage = module.ItemStorage(base_path=self.base_path)
+        with patch.object(module, 'get_file_mtime') as mock_get_file_mtime:
+            mock_get_file_mtime.return_value = time.time() - module.STORAGE_RETENTION_DELTA - 1
+            storage.cleanup(set(), all_groups={'group1'})
+        self.assertTrue(os.path.exists(obj.file))
+
+        storage.cleanup(set(), all_groups={'group2'})
+        self.assertFalse(os.path.exists(obj.file))
+
+
+class NotifItemsTestCase(BaseTestCase):
+    def test_grouped(self):
+        obj = get_collector()
+        url_item1 = module.URLItem(('https://1337x.to/user/1/', 'u1', 'g'))
+        url_item2 = module.URLItem(('https://1337x.to/user/2/', 'u2', 'g'))
+        items = gen_items(range(1, 6))
+        self.assertEqual(obj._get_notif_items(url_item1, items, items), items)
+        items = gen_items(range(3, 8))
+        self.assertEqual(obj._get_notif_items(url_item2, items, items),
+            gen_items(range(6, 8)))
+
+    def test_ungrouped(self):
+        obj = get_collector()
+        url_item1 = module.URLItem(('https://1337x.to/user/1/', 'u1'))
+        url_item2 = module.URLItem(('https://1337x.to/user/2/', 'u2'))
+        items = gen_items(range(1, 6))
+        self.assertEqual(obj._get_notif_items(url_item1, items, items), items)
+        items = gen_items(range(3, 8))
+        self.assertEqual(obj._get_notif_items(url_item2, items, items),
+            gen_items(range(6, 8)))
+        self.assertFalse(obj.seen_indexes)
+
+
+class DriverMonitorTestCase(unittest.TestCase):
+    def _get_process(self, uss, user, system):
+        proc = Mock()
+        proc.memory_full_info.return_value = Mock(uss=uss)
+        proc.cpu_times.return_value = Mock(user=user, system=system)
+        return proc
+
+    def test_1(self):
+        driver = Mock()
+        driver.service.process.pid = os.getpid()
+        obj = module.DriverMonitor()
+        memory, cpu_percent = obj.sample(driver)
+        self.assertTrue(memory > 0)
+        self.assertEqual(cpu_percent, 0)
+
+    def test_peak(self):
+        driver = Mock()
+        samples = [
+            # timestamp, (uss, user, system) of the driver and its child
+            (100, [(10, 1, 0), (100, 2, 0)]),
+            (102, [(10, 1, 0), (300, 5, 1)]),
+            (104, [(10, 1, 0), (200, 5, 2)]),
+        ]
+        obj = module.DriverMonitor()
+        res = []
+        for ts, procs in samples:
+            proc, child = [self._get_process(*r) for r in procs]
+            proc.children.return_value = [child]
+            with patch.object(module.psutil, 'Process') as mock_Process, \
+                    patch.object(module.time, 'time') as mock_time:
+                mock_Process.return_value = proc
+                mock_time.return_value = ts
+                res.append(obj.sample(driver))
+        self.assertEqual(res, [(110, 0), (310, 200), (210, 50)])
+        self.assertEqual(obj.peak_memory, 310)
+        self.assertEqual(obj.peak_cpu_percent, 200)
+
+        obj.reset()
+        proc = self._get_process(10, 0, 0)
+        proc.children.return_value = []
+        with patch.object(module.psutil, 'Process') as mock_Process:
+            mock_Process.return_value = proc
+            self.assertEqual(obj.sample(driver), (10, 0))
+        self.assertEqual(obj.peak_memory, 310)
+        self.assertEqual(obj.peak_cpu_percent, 200)
+
+    def test_no_process(self):
+        driver = Mock(spec=[])
+        obj = module.DriverMonitor()
+        self.assertEqual(obj.sample(driver), (0, 0))
+
+
+class GovernResourcesTestCase(BaseTestCase):
+    def test_restart(self):
+        obj = get_collector(MAX_DRIVER_MEMORY_MB=1)
+        with patch.object(obj.driver_monitor, 'sample') as mock_sample:
+            mock_sample.return_value = (2 * 1024 * 1024, 0)
+            self.assertTrue(obj._govern_resources())
+
+        calls = []
+        obj.driver.quit.side_effect = lambda: calls.append('quit')
+        with patch.object(obj.driver_monitor, 'reset') as mock_reset, \
+                patch.object(module, 'get_driver') as mock_get_driver:
+            mock_get_driver.side_effect = lambda **kwargs: calls.append('start') or Mock()
+            obj._restart_driver()
+        self.assertEqual(calls, ['quit', 'start'])
+        mock_reset.assert_called_once()
+
+    def test_restart_error(self):
+        obj = get_collector(MAX_DRIVER_MEMORY_MB=1)
+        driver = obj.driver
+        with patch.object(module, 'get_driver') as mock_get_driver:
+            mock_get_driver.side_effect = Exception('failed')
+            self.assertRaises(Exception, obj._restart_driver)
+        driver.quit.assert_called_once()
+        self.assertIsNone(obj.driver)
+
+    def test_throttle(self):
+        obj = get_collector(MAX_SYSTEM_CPU_PERCENT=50)
+        driver = obj.driver
+        with patch.object(obj.driver_monitor, 'sample') as mock_sample, \
+                patch.object(module.psutil, 'cpu_percent') as mock_cpu_percent, \
+                patch.object(module.psutil, 'cpu_count') as mock_cpu_count, \
+                patch.object(module.time, 'sleep') as mock_sleep:
+            mock_sample.return_value = (0, 0)
+            mock_cpu_percent.side_effect = [90, 90, 10]
+            mock_cpu_count.return_value = 2
+            self.assertFalse(obj._govern_resources())
+        self.assertEqual(mock_sleep.call_count, 2)
+        driver.quit.assert_not_called()
+
+    def test_throttle_driver_usage(self):
+        obj = get_collector(MAX_SYSTEM_CPU_PERCENT=50)
+        with patch.object(obj.driver_monitor, 'sample') as mock_sample, \
+                patch.object(module.psutil, 'cpu_percent') as mock_cpu_percent, \
+                patch.object(module.psutil, 'cpu_count') as mock_cpu_count, \
+                patch.object(module.time, 'sleep') as mock_sleep:
+            mock_sample.return_value = (0, 100)
+            mock_cpu_percent.return_value = 90
+            mock_cpu_count.return_value = 2
+            obj._govern_resources()
+        mock_sleep.assert_not_called()
+
+
+class TabPoolTestCase(BaseTestCase):
+    def _get_collector(self, max_tabs=3):
+        obj = get_collector(MAX_TABS=max_tabs)
+        handles = ['tab0']
+        self.current = 'tab0'
+        self.max_handles = 1
+
+        def new_window(type_hint):
+            handles.append(f'tab{len(handles)}')
+            self.max_handles = max(self.max_handles, len(handles))
+
+        def switch_to_window(handle):
+            self.current = handle
+
+        def close():
+            handles.remove(self.current)
+
+        obj.driver.window_handles = handles
+        obj.driver.switch_to.new_window.side_effect = new_window
+        obj.driver.switch_to.window.side_effect = switch_to_window
+        obj.driver.close.side_effect = close
+        return obj
+
+    def _get_task(self, url, poll_results, names):
+        parser = Mock()
+        parser.poll.side_effect = poll_results
+        parser.harvest.return_value = names
+        return module.URLItem(url), Mock(return_value=parser)
+
+    def _harvest(self, obj, tasks, restarts=None):
+        with patch.object(module.time, 'sleep') as mock_sleep, \
+                patch.object(obj, '_govern_resources') as mock__govern_resources:
+            mock__govern_resources.side_effect = restarts or (lambda: False)
+            res = list(obj._harvest_tabs(tasks))
+        return res, mock_sleep
+
+    def test_harvest(self):
+        obj = self._get_collector()
+        exc = Exception('timeout')
+        tasks = [
+            self._get_task('https://1337x.to/user/1/', [None, None, ['el']], ['1', '', '2']),
+            self._get_task('https://1337x.to/user/2/', [[]], []),
+            self._get_task('https://1337x.to/user/3/', [None, exc], []),
+        ]
+        res, mock_sleep = self._harvest(obj, tasks)
+        self.assertEqual(res, [(1, []), (2, exc), (0, ['1', '2'])])
+        self.assertEqual(self.max_handles, 3)
+        self.assertEqual(obj.driver.window_handles, ['tab0'])
+        obj.driver.get.assert_called_once_with('about:blank')
+        self.assertEqual(mock_sleep.call_count, 2)
+        parsers = [parser_cls.return_value for _, parser_cls in tasks]
+        for (url_item, _), parser in zip(tasks, parsers):
+            parser.navigate.assert_called_once_with(url_item.url)
+        self.assertEqual(parsers[0].postpone.call_count, 2)
+        self.assertEqual(parsers[2].postpone.call_count, 1)
+
+    def test_harvest_refill(self):
+        obj = self._get_collector(max_tabs=2)
+        tasks = [self._get_task('https://1337x.to/user/0/',
+            [None] * 5 + [['el']], ['0'])]
+        tasks += [self._get_task(f'https://1337x.to/user/{i}/', [['el']], [str(i)])
+            for i in range(1, 5)]
+        res, mock_sleep = self._harvest(obj, tasks)
+        self.assertEqual(res, [(i, [str(i)]) for i in (1, 2, 3, 4, 0)])
+        self.assertEqual(self.max_handles, 2)
+        self.assertEqual(obj.driver.window_handles, ['tab0'])
+        obj.driver.get.assert_called_once_with('about:blank')
+
+    def test_harvest_restart(self):
+        obj = self._get_collector(max_tabs=2)
+        tasks = [self._get_task('https://1337x.to/user/0/', [['el']], ['0']),
+            self._get_task('https://1337x.to/user/1/', [None, ['el']], ['1']),
+            self._get_task('https://1337x.to/user/2/', [['el']], ['2'])]
+        with patch.object(obj, '_restart_driver') as mock__restart_driver:
+            res, _ = self._harvest(obj, tasks, restarts=[True, False, False])
+        self.assertEqual(res, [(0, ['0']), (1, ['1']), (2, ['2'])])
+        mock__restart_driver.assert_called_once()
+        # the pending tab is harvested before the restart
+        self.assertEqual(tasks[1][1].return_value.poll.call_count, 2)
+
+    def test_harvest_tab_error(self):
+        obj = self._get_collector()
+        exc = Exception('failed')
+        obj.driver.switch_to.new_window.side_effect = exc
+        tasks = [self._get_task(f'https://1337x.to/user/{i}/', [['el']], [str(i)])
+            for i in range(3)]
+        res, _ = self._harvest(obj, tasks)
+        self.assertEqual(res, [(i, exc) for i in range(3)])
+        for _, parser_cls in tasks:
+            parser_cls.assert_not_called()
+
+    def test_run(self):
+        obj = self._get_collector()
+        obj.config.URLS = [f'https://1337x.to/user/{i}/' for i in range(5)]
+
+        def harvest_tabs(tasks):
+            for i, (url_item, _) in enumerate(tasks):
+                yield i, [url_item.url]
+
+        with patch.object(obj, '_harvest_tabs') as mock__harvest_tabs, \
+                patch.object(obj.driver_monitor, 'sample'), \
+                patch.object(module.Notifier, 'send') as mock_send:
+            mock__harvest_tabs.side_effect = harvest_tabs
+            obj.run()
+        self.assertEqual([len(r.args[0]) for r in mock__harvest_tabs.call_args_list], [5])
+        self.assertEqual(mock_send.call_count, 5)
+
+    def test_run_error(self):
+        obj = self._get_collector()
+        obj.config.URLS = [(f'https://1337x.to/user/{i}/', str(i), 'group')
+            for i in range(5)]
+        with patch.object(obj, '_process_url_items') as mock__process_url_items:
+            mock__process_url_items.side_effect = KeyboardInterrupt()
+            obj._get_seen_index('group')
+            with patch.object(module.SeenIndex, 'save') as mock_save:
+                self.assertRaises(KeyboardInterrupt, obj.run)
+        mock_save.assert_called_once()
+        obj.driver.quit.assert_called_once()
+
+
 class CleanItemTestCase(unittest.TestCase):
     def test_1(self):
         item = 'L.A. Noire: The Complete Edition (v2675.1 + All DLCs, MULTi6) [FitGirl Repack]'
@@ -120,6 +526,41 @@ class URLItemTestCase(unittest.TestCase):
         self.assertTrue(all(bool(r.id) for r in res))
         self.assertTrue(all(bool(r.url) for r in res))
 
+    def test_group(self):
+        res = module.URLItem(('https://1337x.to/user/FitGirl/', 'fitgirl', 'games'))
+        self.assertEqual(res.group, 'games')
+        res = module.URLItem('https://1337x.to/user/FitGirl/', default_group='all')
+        self.assertEqual(res.group, 'all')
+        res = module.URLItem('https://1337x.to/user/FitGirl/')
+        self.assertIsNone(res.group)
+
+
+class BaseParserTestCase(unittest.TestCase):
+    def _get_parser(self, is_loaded, els):
+        driver = Mock()
+        driver.execute_script.side_effect = [None] + is_loaded
+        parser = base.BaseParser(driver)
+        parser._find_elements = Mock(side_effect=els)
+        parser.navigate('https://1337x.to/user/1/')
+        return parser
+
+    def test_load_timeout(self):
+        parser = self._get_parser([False, False], [])
+        self.assertIsNone(parser.poll())
+        parser.end_ts = time.time() - 1
+        self.assertRaises(Exception, parser.poll)
+        parser._find_elements.assert_not_called()
+
+    def test_timeout(self):
+        parser = self._get_parser([False, True], [None, ['el']])
+        self.assertIsNone(parser.poll())
+        parser.end_ts = time.time() - 1
+        self.assertIsNone(parser.poll())
+        self.assertTrue(parser.end_ts > time.time())
+        self.assertEqual(parser.poll(), ['el'])
+        parser.end_ts = time.time() - 1
+        self.assertRaises(Exception, parser.poll)
+
 
 class ParsersTestCase(unittest.TestCase):
     def test_1(self):
@@ -2,6 +2,7 @@ import logging
 import os
 from pprint import pprint
 import shutil
+import time
 import unittest
 from unittest.mock import patch
 
@@ -36,12 +37,17 @@ class BaseTestCase(unittest.TestCase):
         remove_path(WORK_PATH)
         makedirs(WORK_PATH)
 
-    def _collect(self, urls, headless=True):
+    def _collect(self, urls, headless=True, max_tabs=1):
         return module.collect(Config(
             __file__,
             URLS=urls,
             ITEM_STORAGE_PATH=os.path.join(WORK_PATH, 'parzed'),
+            ITEM_STORAGE_FORMAT='json',
             BROWSER_ID='chrome',
+            DEDUP_GROUP=None,
+            MAX_DRIVER_MEMORY_MB=2048,
+            MAX_SYSTEM_CPU_PERCENT=80,
+            MAX_TABS=max_tabs,
             ),
             headless=headless,
         )
@@ -112,6 +118,28 @@ class CollectorTestCase(BaseTestCase):
         self.assertFalse(call_args_lists[1])
 
 
+class TabPoolTestCase(BaseTestCase):
+    def _get_duration(self, urls, max_tabs):
+        remove_path(WORK_PATH)
+        makedirs(WORK_PATH)
+        start_ts = time.time()
+        with patch.object(module.Notifier, 'send'):
+            self._collect(urls, max_tabs=max_tabs)
+        return time.time() - start_ts
+
+    def test_concurrent_loads(self):
+        urls = [
+            ('https://1337x.to/user/FitGirl/', 'FitGirl'),
+            ('https://1337x.to/user/DODI/', 'DODI'),
+            ('https://1337x.to/cat/Games/1/', 'games'),
+            ('https://1337x.to/cat/Movies/1/', 'movies'),
+            ('https://www.nvidia.com/en-us/geforce/news/', 'geforce news'),
+        ]
+        res = {r: self._get_duration(urls, max_tabs=r) for r in (1, len(urls))}
+        pprint(res)
+        self.assertTrue(res[len(urls)] < res[1])
+
+
 class DriverTestCase(BaseTestCase):
     def test_no_result(self):
         self._collect([